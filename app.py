@@ -1,202 +1,509 @@
-from flask import Flask, request, jsonify
-from flask_restful import Api, Resource
-import yfinance as yf
+from flask import Flask, request
+from werkzeug.exceptions import HTTPException
 from datetime import datetime, timedelta, timezone
-import pandas as pd
+import numpy as np
+import orjson
+from numba import njit
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-import jwt
-import bcrypt
+import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
+import threading
+import time
+from collections import deque
+from cachetools import TTLCache, TLRUCache
+from cachetools.func import ttl_cache
+from requests_cache import CachedSession, DO_NOT_CACHE
 from dotenv import load_dotenv  # Load environment variables
+# yfinance (pulls in pandas), bcrypt and jwt are imported inside the handlers that use them to keep startup fast
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Flask setup
 app = Flask(__name__)
-api = Api(app)
 
 # Load secrets from .env file
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "default_secret_key")
+SECRET_KEY_BYTES = app.config["SECRET_KEY"].encode("utf-8")  # Encoded once, not on every decode
+app.config["MAX_CONTENT_LENGTH"] = 4096  # Request bodies are tiny credential payloads
 MONGO_URI = os.getenv("MONGO_URI")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt cost factor: CPU per hash vs. security
 
-# Establish connection with MongoDB Atlas
-client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
-db = client["stock_db"]  # Your database name
 
-# Collections
-users_collection = db["users"]
-stocks_collection = db["stocks"]
+# 🔹 Establish connection with MongoDB Atlas
+def connect_mongo():
+    global client, db, users_collection, stocks_collection
+    client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
+    db = client["stock_db"]  # Your database name
+
+    # Collections
+    users_collection = db["users"]
+    stocks_collection = db["stocks"]
+
+
+connect_mongo()
+
+# MongoClient is not fork-safe: forked workers (gunicorn --preload, uWSGI, ...) open their own
+os.register_at_fork(after_in_child=connect_mongo)
 
 # Check MongoDB Connection
+mongo_connected = False
 try:
     client.admin.command('ping')
+    mongo_connected = True
     print("✅ Connected to MongoDB successfully!")
 except Exception as e:
     print("❌ MongoDB connection error:", e)
 
+# Unique indexes for the fields every request looks up by. Until the username index is confirmed,
+# Register keeps checking for an existing user itself.
+MONGO_INDEX_TIMEOUT = 10  # Seconds; keeps a struggling server from stalling startup
+username_index_ready = False
+if mongo_connected:  # Otherwise each create_index would wait out its own server-selection timeout
+    try:
+        with pymongo.timeout(MONGO_INDEX_TIMEOUT):
+            users_collection.create_index("username", unique=True)
+        username_index_ready = True
+    except Exception as e:
+        print("❌ Could not create unique index on users.username (duplicate usernames?):", e)
+
+    try:
+        with pymongo.timeout(MONGO_INDEX_TIMEOUT):
+            stocks_collection.create_index("symbol", unique=True)
+    except Exception as e:
+        print("❌ Could not create unique index on stocks.symbol:", e)
+
+# In-process caches (keyed by symbol) to avoid re-querying yfinance on every request
+info_cache = TTLCache(maxsize=4096, ttl=3600)  # Company info changes rarely
+PRICE_MAX_AGE = 30  # Seconds a stored latest price is served before it is re-fetched
+MONGO_LOOKUP_TIMEOUT = 0.5  # Seconds to wait for a stored price before asking yfinance instead
+
+
+def price_age(doc):
+    return (datetime.now(timezone.utc) - datetime.fromisoformat(doc["timestamp"])).total_seconds()
+
+
+# Prices expire PRICE_MAX_AGE after their own timestamp, not after they were cached
+price_cache = TLRUCache(maxsize=4096, ttu=lambda symbol, doc, now: now + PRICE_MAX_AGE - price_age(doc))
+history_cache = TTLCache(maxsize=64, ttl=3600)  # Encoded JSON bodies keyed by (symbol, start, end)
+cache_lock = threading.Lock()  # Flask's server is threaded
+
+# Validated JWT payloads keyed by raw token; kept for at most 60s and never past the token's own expiry
+jwt_cache = TLRUCache(
+    maxsize=10_000,
+    ttu=lambda token, payload, now: now + min(60, payload.get("exp", float("inf")) - time.time()),
+)
+
+# Pending stock documents, upserted into MongoDB in one bulk_write every FLUSH_INTERVAL seconds
+pending_ops = deque()
+FLUSH_INTERVAL = 0.5
+
+
+# 🔹 Background worker: Drain pending upserts into a single unordered bulk_write
+def flush_pending_ops():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        # Keep only the newest price per symbol: an unordered bulk_write may apply a batch in any order
+        latest = {}
+        while pending_ops:
+            data = pending_ops.popleft()
+            current = latest.get(data["symbol"])
+            if current is None or (
+                datetime.fromisoformat(data["timestamp"]) >= datetime.fromisoformat(current["timestamp"])
+            ):
+                latest[data["symbol"]] = data
+        if not latest:
+            continue
+        ops = [UpdateOne({"symbol": symbol}, {"$set": data}, upsert=True) for symbol, data in latest.items()]
+        try:
+            stocks_collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            print("❌ MongoDB bulk write error:", e)
+
+
+# Symbols seen by /stock, prefetched together in one batched download every PREFETCH_INTERVAL seconds.
+# A symbol drops off the watchlist once it hasn't been served for WATCHLIST_TTL seconds.
+WATCHLIST_TTL = 300
+watchlist = TTLCache(maxsize=512, ttl=WATCHLIST_TTL)
+prefetched_prices = {}  # symbol -> (price, fetched_at epoch seconds)
+PREFETCH_INTERVAL = PRICE_MAX_AGE
+
+
+# 🔹 Background worker: Refresh latest prices for the whole watchlist in a single yf.download
+def prefetch_watchlist():
+    global prefetched_prices
+    while True:
+        time.sleep(PREFETCH_INTERVAL)
+        with cache_lock:
+            symbols = list(watchlist)
+        if not symbols:
+            continue
+        try:
+            import yfinance as yf
+
+            df = yf.download(
+                symbols, period="1d", threads=True, group_by="ticker", progress=False, session=get_yf_session()
+            )
+            fetched_at = time.time()
+            downloaded = set(df.columns.get_level_values(0))
+            prices = {}
+            for symbol in symbols:
+                if symbol not in downloaded:  # One bad ticker must not abort the whole batch
+                    continue
+                close = df[symbol]["Close"].to_numpy(copy=False)
+                close = close[~np.isnan(close)]
+                if close.size:
+                    prices[symbol] = (float(close[-1]), fetched_at)
+            prefetched_prices = prices  # Symbols that failed or left the watchlist are dropped
+        except Exception as e:
+            print("❌ Watchlist prefetch error:", e)
+
+
+# 🔹 Start background workers on first use, once per process (threads don't survive fork)
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+
+def ensure_background_workers():
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid != os.getpid():
+            threading.Thread(target=flush_pending_ops, daemon=True).start()
+            threading.Thread(target=prefetch_watchlist, daemon=True).start()
+            _workers_pid = os.getpid()
+
+
+# 🔹 Helper function: HTTP session for yfinance (keep-alive plus an in-memory response cache)
+# Only company info responses are cached; chart (price/history) requests repeat the same URL, so caching
+# them would serve old prices as fresh. Built lazily per process so workers never share a cache.
+YF_CACHE_URLS = {
+    "*/v10/finance/quoteSummary/*": 300,
+    "*/v7/finance/quote*": 300,
+}
+_yf_sessions = {}
+
+
+def get_yf_session():
+    pid = os.getpid()
+    session = _yf_sessions.get(pid)
+    if session is None:
+        with cache_lock:
+            session = _yf_sessions.get(pid)
+            if session is None:
+                _yf_sessions.clear()  # Drop a session inherited from the parent
+                session = _yf_sessions[pid] = CachedSession(
+                    "yf_cache", backend="memory", expire_after=DO_NOT_CACHE, urls_expire_after=YF_CACHE_URLS
+                )
+    return session
+
+
+# 🔹 Helper function: SMA-50/SMA-200 crossover signal (JIT-compiled, only the last value is needed)
+# Returns 1 (BUY), -1 (SELL) or 0 (HOLD); callers must pass at least 200 closes.
+@njit(cache=True)
+def sma_signal(close):
+    price = close[-1]
+    sma_50 = close[-50:].mean()
+    sma_200 = close[-200:].mean()
+    trend = int(sma_50 > sma_200) - int(sma_50 < sma_200)
+    momentum = int(price > sma_50) - int(price < sma_50)
+    return trend * (trend == momentum)
+
+
+# Recommendation labels indexed by sma_signal() + 1
+SIGNAL_LABELS = ("SELL", "HOLD", "BUY")
+
+
+# Warm up the JIT at import time so the first request doesn't pay the compile cost
+sma_signal(np.zeros(200, dtype=np.float64))
+
+
+# 🔹 Helper function: Reuse yf.Ticker objects per symbol
+# Tickers memoize info internally, so they are dropped after 30s instead of living for the whole process
+@ttl_cache(maxsize=1024, ttl=30)
+def get_ticker(symbol):
+    import yfinance as yf
+
+    return yf.Ticker(symbol, session=get_yf_session())
+
+
+# 🔹 Helper function: Encode to JSON bytes with orjson (handles NumPy scalars natively)
+def dump_json(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+# 🔹 Helper function: JSON response from an already-encoded body
+def json_response(body):
+    return app.response_class(body, mimetype="application/json")
+
+
+# 🔹 Helper function: Current UTC time as ISO string, formatted at most once per second
+_ts_cache = [0, ""]
+
+
+def now_iso():
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache[1] = datetime.fromtimestamp(t, timezone.utc).isoformat()
+        _ts_cache[0] = t
+    return _ts_cache[1]
+
 
 # 🔹 Helper function: Fetch stock data and store in MongoDB
 def fetch_stock_data(symbol):
+    symbol = symbol.upper()  # yfinance upper-cases tickers; keep caches, watchlist and MongoDB consistent
+
+    with cache_lock:
+        cached = price_cache.get(symbol)
+    if cached is not None:
+        return cached
+
+    # A recent price already stored in MongoDB is much cheaper than a Yahoo round-trip.
+    # It's only a shortcut: if MongoDB is slow or down, fall through to yfinance.
     try:
-        stock = yf.Ticker(symbol)
-        hist = stock.history(period="1d")
+        with pymongo.timeout(MONGO_LOOKUP_TIMEOUT):
+            doc = stocks_collection.find_one(
+                {"symbol": symbol}, {"_id": 0, "symbol": 1, "latest_price": 1, "timestamp": 1}
+            )
+        if doc and "timestamp" in doc and price_age(doc) < PRICE_MAX_AGE:
+            with cache_lock:
+                price_cache[symbol] = doc
+            return doc
+    except Exception as e:
+        print("❌ MongoDB price lookup error:", e)
 
-        if hist.empty:
-            return {"message": "Stock data not found"}, 404
+    try:
+        latest_price, fetched_at = prefetched_prices.get(symbol, (None, 0.0))
+        if time.time() - fetched_at >= PRICE_MAX_AGE:  # Missing, or the last prefetch couldn't refresh it
+            stock = get_ticker(symbol)
+            hist = stock.history(period="1d")
+
+            if hist.empty:
+                return {"message": "Stock data not found"}, 404
+
+            latest_price = float(hist["Close"].iloc[-1])
+            fetched_at = None
+
+        with cache_lock:
+            watchlist[symbol] = True  # Add, or keep it from expiring
+
+        if fetched_at is None:
+            timestamp = now_iso()
+        else:  # Prefetched prices keep their download time so they aren't passed off as newer
+            timestamp = datetime.fromtimestamp(fetched_at, timezone.utc).isoformat()
 
-        latest_price = hist["Close"].iloc[-1]
         data = {
             "symbol": symbol,
             "latest_price": latest_price,
-            "timestamp": datetime.now(timezone.utc).isoformat(),  # ✅ Fixed datetime issue
+            "timestamp": timestamp,
         }
 
-        # Store data in MongoDB
-        stocks_collection.update_one({"symbol": symbol}, {"$set": data}, upsert=True)
+        # Queue the upsert; the background worker batches it into MongoDB
+        ensure_background_workers()
+        pending_ops.append(data)
+
+        with cache_lock:
+            price_cache[symbol] = data
         return data
     except Exception as e:
         return {"error": str(e)}, 500
 
 
+# 🔹 Helper function: Read username/password from the JSON body, or None if missing or invalid
+def read_credentials():
+    data = request.get_json(cache=False, silent=True)
+    if not isinstance(data, dict):
+        return None
+
+    username = data.get("username")
+    password = data.get("password")
+    if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+        return None
+    return username, password
+
+
+# 🔹 Error handlers: Keep errors JSON (as flask_restful's error router did), never Werkzeug HTML pages
+@app.errorhandler(HTTPException)
+def handle_http_error(e):
+    return {"message": e.description}, e.code
+
+
+@app.errorhandler(Exception)
+def handle_unexpected_error(e):
+    app.logger.exception(e)
+    return {"message": "Internal Server Error"}, 500
+
+
 # 🔹 User Registration
-class Register(Resource):
-    def post(self):
-        try:
-            data = request.json
-            username = data["username"]
-            password = data["password"]
+@app.post("/register")
+def register():
+    import bcrypt
+
+    # Parsed outside the try so an oversized body still surfaces as 413
+    credentials = read_credentials()
+    if credentials is None:
+        return {"message": "Provide 'username' and 'password' in the JSON body."}, 400
+    username, password = credentials
+    if len(password.encode("utf-8")) > 72:  # bcrypt only uses the first 72 bytes
+        return {"message": "Password must be at most 72 bytes."}, 400
 
-            if users_collection.find_one({"username": username}):
-                return {"message": "User already exists"}, 400
+    try:
+        if not username_index_ready and users_collection.find_one({"username": username}):
+            return {"message": "User already exists"}, 400
 
-            hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(BCRYPT_ROUNDS))
+        try:
             users_collection.insert_one({"username": username, "password": hashed_password})
-            return {"message": "User registered successfully"}, 201
-        except Exception as e:
-            return {"error": str(e)}, 500
+        except DuplicateKeyError:  # Unique index on username (catches races the pre-check can't)
+            return {"message": "User already exists"}, 400
+        return {"message": "User registered successfully"}, 201
+    except Exception as e:
+        return {"error": str(e)}, 500
 
 
 # 🔹 User Login
-class Login(Resource):
-    def post(self):
-        try:
-            data = request.json
-            username = data["username"]
-            password = data["password"]
-
-            user = users_collection.find_one({"username": username})
-            if not user or not bcrypt.checkpw(password.encode("utf-8"), user["password"]):
-                return {"message": "Invalid credentials"}, 401
-
-            token = jwt.encode(
-                {"username": username, "exp": datetime.now(timezone.utc) + timedelta(hours=2)},
-                app.config["SECRET_KEY"],
-                algorithm="HS256",
-            )
-            return {"token": token}, 200
-        except Exception as e:
-            return {"error": str(e)}, 500
+@app.post("/login")
+def login():
+    import bcrypt
+    import jwt
+
+    credentials = read_credentials()
+    if credentials is None:
+        return {"message": "Provide 'username' and 'password' in the JSON body."}, 400
+    username, password = credentials
+
+    try:
+        user = users_collection.find_one({"username": username})
+        # Older accounts may have longer passwords, which bcrypt truncated to 72 bytes when hashing
+        password_bytes = password.encode("utf-8")[:72]
+        if not user or not bcrypt.checkpw(password_bytes, user["password"]):
+            return {"message": "Invalid credentials"}, 401
+
+        token = jwt.encode(
+            {"username": username, "exp": datetime.now(timezone.utc) + timedelta(hours=2)},
+            SECRET_KEY_BYTES,
+            algorithm="HS256",
+        )
+        return {"token": token}, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
 
 
 # 🔹 Protected Route (Requires JWT)
-class StockMarketData(Resource):
-    def get(self, symbol):
-        token = request.headers.get("Authorization")
-        if not token:
-            return {"message": "Token is missing"}, 401
+@app.get("/stock/<string:symbol>")
+def stock_market_data(symbol):
+    import jwt
 
-        try:
-            jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
-            return {"message": "Token has expired"}, 401
-        except jwt.InvalidTokenError:
-            return {"message": "Token is invalid"}, 401
+    token = request.headers.get("Authorization")
+    if not token:
+        return {"message": "Token is missing"}, 401
 
-        return fetch_stock_data(symbol), 200
+    with cache_lock:
+        payload = jwt_cache.get(token)
+    try:
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY_BYTES, algorithms=["HS256"])
+            with cache_lock:
+                jwt_cache[token] = payload
+    except jwt.ExpiredSignatureError:
+        return {"message": "Token has expired"}, 401
+    except jwt.InvalidTokenError:
+        return {"message": "Token is invalid"}, 401
+
+    return fetch_stock_data(symbol)
 
 
 # 🔹 1. Company Information Endpoint
-class CompanyInfo(Resource):
-    def get(self, symbol):
-        try:
-            stock = yf.Ticker(symbol)
+@app.get("/company/<string:symbol>")
+def company_info(symbol):
+    try:
+        with cache_lock:
+            info = info_cache.get(symbol)
+        if info is None:
+            stock = get_ticker(symbol)
             info = stock.info
-            return {
-                "symbol": symbol,
-                "name": info.get("longName"),
-                "industry": info.get("industry"),
-                "market_cap": info.get("marketCap"),
-                "sector": info.get("sector"),
-                "website": info.get("website"),
-            }, 200
-        except Exception as e:
-            return {"error": str(e)}, 500
+            with cache_lock:
+                info_cache[symbol] = info
+
+        return {
+            "symbol": symbol,
+            "name": info.get("longName"),
+            "industry": info.get("industry"),
+            "market_cap": info.get("marketCap"),
+            "sector": info.get("sector"),
+            "website": info.get("website"),
+        }, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
 
 
 # 🔹 2. Historical Market Data Endpoint
-class HistoricalMarketData(Resource):
-    def get(self, symbol):
-        start_date = request.args.get("start")
-        end_date = request.args.get("end")
+@app.get("/historical/<string:symbol>")
+def historical_market_data(symbol):
+    start_date = request.args.get("start")
+    end_date = request.args.get("end")
 
-        if not start_date or not end_date:
-            return {"message": "Provide 'start' and 'end' query parameters in YYYY-MM-DD format."}, 400
+    if not start_date or not end_date:
+        return {"message": "Provide 'start' and 'end' query parameters in YYYY-MM-DD format."}, 400
 
-        stock = yf.Ticker(symbol)
+    # Reject bad input before it costs a yfinance round-trip
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        return {"message": "Provide 'start' and 'end' query parameters in YYYY-MM-DD format."}, 400
+
+    if end <= start:
+        return {"message": "'end' must be after 'start'."}, 400
+    if end - start > timedelta(days=3653):
+        return {"message": "Date range cannot exceed 10 years."}, 400
+
+    key = (symbol, start, end)
+    with cache_lock:
+        body = history_cache.get(key)
+
+    if body is None:
+        stock = get_ticker(symbol)
         hist = stock.history(start=start_date, end=end_date)
 
         if hist.empty:
             return {"message": "No historical data found for the given date range."}, 404
 
-        historical_data = {
-            str(date): {
-                "Open": row["Open"],
-                "High": row["High"],
-                "Low": row["Low"],
-                "Close": row["Close"],
-                "Volume": row["Volume"],
-            }
-            for date, row in hist.iterrows()
-        }
+        # Vectorized conversion (avoids building a Series per row with iterrows)
+        ohlcv = hist[["Open", "High", "Low", "Close", "Volume"]]
+        ohlcv = ohlcv.set_axis(ohlcv.index.astype(str))
+        body = dump_json(ohlcv.to_dict(orient="index"))
+
+        # Cache the encoded bytes: far smaller than per-row dicts, and repeats skip re-serializing
+        with cache_lock:
+            history_cache[key] = body
 
-        return jsonify(historical_data)
+    return json_response(body)
 
 
 # 🔹 3. Analytical Insights (Simple Moving Average Strategy)
-class AnalyticalInsights(Resource):
-    def get(self, symbol):
-        try:
-            stock = yf.Ticker(symbol)
-            hist = stock.history(period="3mo")
-            hist["SMA_50"] = hist["Close"].rolling(window=50).mean()
-            hist["SMA_200"] = hist["Close"].rolling(window=200).mean()
-
-            latest_sma_50 = hist["SMA_50"].iloc[-1]
-            latest_sma_200 = hist["SMA_200"].iloc[-1]
-            latest_price = hist["Close"].iloc[-1]
-
-            if latest_sma_50 > latest_sma_200 and latest_price > latest_sma_50:
-                recommendation = "BUY"
-            elif latest_sma_50 < latest_sma_200 and latest_price < latest_sma_50:
-                recommendation = "SELL"
-            else:
-                recommendation = "HOLD"
-
-            return {"symbol": symbol, "recommendation": recommendation}, 200
-        except Exception as e:
-            return {"error": str(e)}, 500
+@app.get("/insights/<string:symbol>")
+def analytical_insights(symbol):
+    try:
+        stock = get_ticker(symbol)
+        hist = stock.history(period="1y")  # ~252 trading days, enough for SMA-200
+        if hist.empty:
+            return {"message": "Stock data not found"}, 404
+
+        close = hist["Close"].to_numpy(dtype=np.float64, copy=False)  # Zero-copy view, Close is already float64
+        if close.size < 200:
+            return {"symbol": symbol, "recommendation": "HOLD", "reason": "insufficient history"}, 200
 
+        recommendation = SIGNAL_LABELS[sma_signal(close) + 1]
+        return {"symbol": symbol, "recommendation": recommendation}, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
 
-# 🏗 Adding Resources to API
-api.add_resource(Register, "/register")
-api.add_resource(Login, "/login")
-api.add_resource(CompanyInfo, "/company/<string:symbol>")
-api.add_resource(StockMarketData, "/stock/<string:symbol>")
-api.add_resource(HistoricalMarketData, "/historical/<string:symbol>")
-api.add_resource(AnalyticalInsights, "/insights/<string:symbol>")
 
-# 🚀 Run Flask App
+# 🚀 Run Flask App (development server; use gunicorn in production, see gunicorn.conf.py)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,22 @@
+import multiprocessing
+import os
+
+# Keep NumPy/pandas BLAS pools single-threaded so workers don't oversubscribe the cores
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+bind = "0.0.0.0:5000"
+workers = multiprocessing.cpu_count()
+threads = 4
+worker_class = "gthread"
+
+# Import app (and compile the Numba SMA kernel) once in the master; workers share it copy-on-write
+preload_app = True
+
+
+def on_starting(server):
+    # app.py imports these lazily; load them in the master too so forked workers don't each pay for them
+    import bcrypt  # noqa: F401
+    import jwt  # noqa: F401
+    import yfinance  # noqa: F401  (pulls in pandas)